@@ -7,6 +7,9 @@ import hmac
 import hashlib
 from flask import request
 from offers import get_offer_by_id
+from entitlements import fulfill_offer
+
+logger = logging.getLogger(__name__)
 
 def init_coinbase_webhook_routes(app):
     webhook_secret = os.environ.get("COINBASE_WEBHOOK_SECRET")
@@ -21,7 +24,7 @@ def init_coinbase_webhook_routes(app):
             
             return hmac.compare_digest(signature, expected_sig)
         except Exception as e:
-            logging.error(f"Error verifying Coinbase signature: {e}")
+            logger.error("Error verifying Coinbase signature: %s", e)
             return False
 
     @app.route('/webhook/coinbase', methods=['POST'])
@@ -30,7 +33,7 @@ def init_coinbase_webhook_routes(app):
             # Get the signature from headers
             signature = request.headers.get('X-CC-Webhook-Signature')
             if not signature:
-                logging.error(f"Missing Coinbase webhook signature: {request.headers}")
+                logger.error("Missing Coinbase webhook signature")
                 return {}, 200
 
             # Get raw request payload
@@ -38,7 +41,7 @@ def init_coinbase_webhook_routes(app):
 
             # Verify signature
             if not verify_coinbase_signature(payload, signature, webhook_secret):
-                logging.error(f"Invalid Coinbase webhook signature({signature}): {payload}")
+                logger.error("Invalid Coinbase webhook signature(%s)", signature)
                 return {}, 200
 
             webhook_data = request.json
@@ -46,7 +49,7 @@ def init_coinbase_webhook_routes(app):
             
             # Check if this is a charge event and get charge data
             if event.get('type') != 'charge:pending':
-                logging.info(f"Coinbase webhook event type({event.get('type')}): {event}")
+                logger.info("Coinbase webhook event type(%s): %s", event.get('type'), event.get('id'))
                 return {}, 200
             
             charge_data = event.get('data', {})
@@ -54,18 +57,18 @@ def init_coinbase_webhook_routes(app):
             # Check metadata app_id
             metadata = charge_data.get('metadata', {})
             if metadata.get('app_id') != os.environ.get("APP_ID"):
-                logger.error(f"Invalid app_id in webhook metadata: {metadata.get('app_id')}")
+                logger.error("Invalid app_id in webhook metadata: %s", metadata.get('app_id'))
                 return True
 
             charge_code = charge_data.get('code')
             if not charge_code:
-                logging.error("Missing charge code in webhook data")
+                logger.error("Missing charge code in webhook data")
                 return {}, 200
             
             # Load payment request data
             payment_request = db.get_payment_request(charge_code)
             if not payment_request:
-                logging.error(f"Invalid payment request: {charge_code}")
+                logger.error("Invalid payment request: %s", charge_code)
                 return {}, 200
                 
             user_id = payment_request['user_id']
@@ -74,17 +77,17 @@ def init_coinbase_webhook_routes(app):
             # Load offer details
             offer = get_offer_by_id(offer_id)
             if not offer:
-                logging.error(f"Invalid offer: {offer_id}")
+                logger.error("Invalid offer: %s", offer_id)
                 return {}, 200
             
-            # Update user credits based on offer
-            db.update_user_credits(user_id, offer['balance'])
+            # Grant the credits or time pass of the offer
+            credits = fulfill_offer(user_id, offer)
             
             # Record the completed payment
             pricing = charge_data.get('pricing', {}).get('local', {})
             db.record_payment(
                 payment_request_id=payment_request['id'],
-                credits=offer['balance'],
+                credits=credits,
                 amount=int(float(pricing.get('amount', 0)) * 100),  # Convert to cents
                 currency=pricing.get('currency', '').upper(),
             )
@@ -92,7 +95,7 @@ def init_coinbase_webhook_routes(app):
             return {'status': 'success'}, 200
             
         except Exception as e:
-            logging.error(f"Error handling Coinbase webhook: {e}")
+            logger.error("Error handling Coinbase webhook: %s", e)
             return {}, 200
 
 def create_coinbase_charge(user_id, offer, expiry):
@@ -125,7 +128,7 @@ def create_coinbase_charge(user_id, offer, expiry):
        
         response = requests.post(url, json=payload, headers=headers)
         if not response.ok:
-            logging.error(f"Coinbase charge creation failed: {response.text}")
+            logger.error("Coinbase charge creation failed: %s", response.text)
             return None
     
         charge_data = response.json()["data"]
@@ -134,7 +137,8 @@ def create_coinbase_charge(user_id, offer, expiry):
         db.create_payment_request(
             request_id=charge_data["code"],
             user_id=user_id,
-            offer_id=offer["offer_id"]
+            offer_id=offer["offer_id"],
+            expires_at=expiry
         )
         
         return {
@@ -144,5 +148,5 @@ def create_coinbase_charge(user_id, offer, expiry):
         
 
     except Exception as e:
-        logging.error(f"Error creating Coinbase charge: {e}")
+        logger.error("Error creating Coinbase charge: %s", e)
         return None
@@ -0,0 +1,10 @@
+-- Archive database - expired payment requests that were never paid, moved
+-- out of the main database by the sweeper
+CREATE TABLE IF NOT EXISTS payment_requests (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    offer_id TEXT NOT NULL,
+    expires_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL,
+    archived_at TIMESTAMP NOT NULL
+);
@@ -1,4 +1,5 @@
 import os
+import fcntl
 import sqlite3
 from uuid import uuid4
 from contextlib import contextmanager
@@ -8,12 +9,13 @@ from datetime import datetime, timezone
 class Database:
     def __init__(self):
         self.db_url = os.getenv('DATABASE_URL', 'app.db')
+        self.archive_db_url = os.getenv('ARCHIVE_DATABASE_URL', 'archive.db')
         self.init_db()
     
     @contextmanager
-    def get_connection(self):
+    def get_connection(self, db_url: Optional[str] = None):
         conn = sqlite3.connect(
-            self.db_url,
+            db_url or self.db_url,
             detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
         )
         conn.row_factory = sqlite3.Row
@@ -26,22 +28,55 @@ class Database:
         finally:
             conn.close()
 
+    @contextmanager
+    def file_lock(self, path: str):
+        # Exclusive lock shared by every process using the database, e.g. all
+        # gunicorn workers or the debug reloader and its child
+        with open(path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
     def init_db(self):
+        # Processes start concurrently, only one of them runs the migration and
+        # the others find the database already migrated once they get the lock.
+        with self.file_lock(self.db_url + '.lock'):
+            self._init_db()
+
+    def _init_db(self):
         conn = sqlite3.connect(self.db_url)
         try:
-            # Check if tables exist first
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='users'
-            """)
-            if cursor.fetchone() is None:
-                # Only create tables if they don't exist
-                with open('database/schema.sql', 'r') as f:
-                    conn.executescript(f.read())
+            self.migrate_db(conn)
+            # The schema only creates missing tables and indexes, so it is safe
+            # to apply on every start and picks up tables added later on.
+            with open('database/schema.sql', 'r') as f:
+                conn.executescript(f.read())
         finally:
             conn.close()
 
+        conn = sqlite3.connect(self.archive_db_url)
+        try:
+            with open('database/archive_schema.sql', 'r') as f:
+                conn.executescript(f.read())
+        finally:
+            conn.close()
+
+    def migrate_db(self, conn: sqlite3.Connection):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(payment_requests)')]
+        if columns and 'expires_at' not in columns:
+            # Requests created before expires_at existed are long expired
+            conn.execute('ALTER TABLE payment_requests ADD COLUMN expires_at TIMESTAMP')
+            conn.execute('UPDATE payment_requests SET expires_at = created_at')
+            conn.commit()
+
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if columns and auto_vacuum != 2:
+            # Switching an existing database to incremental auto-vacuum needs a full VACUUM
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+
     # User methods
     def create_user(self, credits: int = 1) -> Dict:
         user_id = str(uuid4())
@@ -54,6 +89,29 @@ class Database:
             )
         return self.get_user(user_id)
 
+    def create_users(self, count: int, credits: int = 1) -> List[Dict]:
+        """
+        Create many users in a single transaction. Ids are generated upfront so
+        the users can be returned without reading them back.
+        """
+        timestamp = datetime.now(timezone.utc)
+        users = [
+            {
+                'id': str(uuid4()),
+                'credits': credits,
+                'last_credit_update_at': timestamp,
+                'created_at': timestamp,
+            }
+            for _ in range(count)
+        ]
+
+        with self.get_connection() as conn:
+            conn.executemany(
+                'INSERT INTO users (id, credits, created_at, last_credit_update_at) VALUES (?, ?, ?, ?)',
+                [(user['id'], credits, timestamp, timestamp) for user in users]
+            )
+        return users
+
     def get_user(self, user_id: str) -> Optional[Dict]:
         with self.get_connection() as conn:
             row = conn.execute(
@@ -70,15 +128,54 @@ class Database:
                 SET credits = credits + ?, last_credit_update_at = ?
                 WHERE id = ?
             ''', (credits_delta, timestamp, user_id))
+
+    def get_last_paid_offer_id(self, user_id: str, exclude_offer_ids: Optional[List[str]] = None) -> Optional[str]:
+        exclude_offer_ids = exclude_offer_ids or []
+        placeholders = ', '.join('?' for _ in exclude_offer_ids)
+        with self.get_connection() as conn:
+            row = conn.execute(f'''
+                SELECT payment_requests.offer_id FROM payments
+                JOIN payment_requests ON payments.payment_request_id = payment_requests.id
+                WHERE payment_requests.user_id = ?
+                AND payment_requests.offer_id NOT IN ({placeholders})
+                ORDER BY payments.created_at DESC
+                LIMIT 1
+            ''', (user_id, *exclude_offer_ids)).fetchone()
+            return row['offer_id'] if row else None
     
+    # Entitlement methods
+    def create_entitlement(self, user_id: str, offer_id: str, expires_at: datetime) -> Dict:
+        timestamp = datetime.now(timezone.utc)
+
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                '''INSERT INTO entitlements
+                   (user_id, offer_id, expires_at, created_at)
+                   VALUES (?, ?, ?, ?)
+                   RETURNING *''',
+                (user_id, offer_id, expires_at, timestamp)
+            )
+            row = cursor.fetchone()
+            return dict(row)
+
+    def get_active_entitlement(self, user_id: str) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            row = conn.execute('''
+                SELECT * FROM entitlements
+                WHERE user_id = ? AND expires_at > ?
+                ORDER BY expires_at DESC
+                LIMIT 1
+            ''', (user_id, datetime.now(timezone.utc))).fetchone()
+            return dict(row) if row else None
+
     # Payment methods
-    def create_payment_request(self, request_id: str, user_id: str, offer_id: str) -> Dict:
+    def create_payment_request(self, request_id: str, user_id: str, offer_id: str, expires_at: datetime) -> Dict:
         timestamp = datetime.now(timezone.utc)
         
         with self.get_connection() as conn:
             conn.execute(
-                'INSERT INTO payment_requests (id, user_id, offer_id, created_at) VALUES (?, ?, ?, ?)',
-                (request_id, user_id, offer_id, timestamp)
+                'INSERT INTO payment_requests (id, user_id, offer_id, expires_at, created_at) VALUES (?, ?, ?, ?, ?)',
+                (request_id, user_id, offer_id, expires_at, timestamp)
             )
             row = conn.execute(
                 'SELECT * FROM payment_requests WHERE id = ?', 
@@ -92,8 +189,49 @@ class Database:
                 'SELECT * FROM payment_requests WHERE id = ?',
                 (request_id,)
             ).fetchone()
+            if row:
+                return dict(row)
+
+        # Payments can still arrive after a request was archived, e.g. Coinbase
+        # charges have no expiry. This only happens on the rare miss path.
+        with self.get_connection(self.archive_db_url) as conn:
+            row = conn.execute(
+                'SELECT id, user_id, offer_id, expires_at, created_at FROM payment_requests WHERE id = ?',
+                (request_id,)
+            ).fetchone()
             return dict(row) if row else None
 
+    def archive_expired_payment_requests(self, expired_before: datetime, batch_size: int) -> int:
+        """
+        Move a batch of unpaid payment requests that expired before the given
+        time to the archive database. Returns the number of requests archived.
+        """
+        timestamp = datetime.now(timezone.utc)
+
+        with self.get_connection() as conn:
+            conn.execute('ATTACH DATABASE ? AS archive', (self.archive_db_url,))
+            ids = [(row['id'],) for row in conn.execute('''
+                SELECT id FROM payment_requests
+                WHERE expires_at < ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM payments WHERE payments.payment_request_id = payment_requests.id
+                )
+                LIMIT ?
+            ''', (expired_before, batch_size))]
+
+            conn.executemany('''
+                INSERT OR IGNORE INTO archive.payment_requests
+                (id, user_id, offer_id, expires_at, created_at, archived_at)
+                SELECT id, user_id, offer_id, expires_at, created_at, ?
+                FROM main.payment_requests WHERE id = ?
+            ''', [(timestamp, request_id) for (request_id,) in ids])
+            conn.executemany('DELETE FROM main.payment_requests WHERE id = ?', ids)
+            return len(ids)
+
+    def incremental_vacuum(self, pages: int) -> None:
+        with self.get_connection() as conn:
+            conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+
     def record_payment(self, payment_request_id: str, credits: int, amount: int, currency: str) -> Dict:
         timestamp = datetime.now(timezone.utc)
         
@@ -1,5 +1,10 @@
+-- Incremental auto-vacuum lets the sweeper give pages of archived payment
+-- requests back to the filesystem a few at a time. Only applies to new databases,
+-- existing ones are converted by Database.init_db.
+PRAGMA auto_vacuum = INCREMENTAL;
+
 -- Users table - core user data
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id TEXT PRIMARY KEY,
 
     credits INTEGER NOT NULL DEFAULT 0,
@@ -9,16 +14,20 @@ CREATE TABLE users (
 );
 
 -- payment_requests table - all payment requests
-CREATE TABLE payment_requests (
+CREATE TABLE IF NOT EXISTS payment_requests (
     id TEXT PRIMARY KEY,
     user_id TEXT NOT NULL,
     offer_id TEXT NOT NULL,
+    expires_at TIMESTAMP,
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+CREATE INDEX IF NOT EXISTS idx_payment_requests_expires_at ON payment_requests(expires_at);
+CREATE INDEX IF NOT EXISTS idx_payment_requests_user_id ON payment_requests(user_id);
+
 -- Payments table - all completed payments
-CREATE TABLE payments (
+CREATE TABLE IF NOT EXISTS payments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     payment_request_id TEXT NOT NULL,
     credits INTEGER NOT NULL,
@@ -27,3 +36,17 @@ CREATE TABLE payments (
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (payment_request_id) REFERENCES payment_requests(id)
 );
+
+CREATE INDEX IF NOT EXISTS idx_payments_payment_request_id ON payments(payment_request_id);
+
+-- Entitlements table - time-window access passes
+CREATE TABLE IF NOT EXISTS entitlements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    offer_id TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_entitlements_user_id_expires_at ON entitlements(user_id, expires_at);
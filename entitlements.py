@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict
+from database import db
+
+# In-memory cache of active time passes, so authenticated calls can be checked
+# without touching the database and passes never cost a write per call.
+# Active passes are cached until they expire. Users without a pass are
+# re-checked after ENTITLEMENT_NEGATIVE_CACHE_SECONDS so passes granted by
+# another worker are picked up. At most ENTITLEMENT_CACHE_MAX_USERS users are
+# cached, least recently used go first.
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    # sqlite returns naive timestamps, all of them are stored in UTC
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+# Get the user's active time pass, if any
+def get_active_entitlement(user_id: str) -> Optional[Dict]:
+    now = datetime.now(timezone.utc)
+
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached is not None:
+            _cache.move_to_end(user_id)
+    if cached is not None:
+        entitlement, checked_at = cached
+        if entitlement is not None and entitlement["expires_at"] > now:
+            return entitlement
+        negative_cache_seconds = int(os.getenv("ENTITLEMENT_NEGATIVE_CACHE_SECONDS", "30"))
+        if entitlement is None and (now - checked_at).total_seconds() < negative_cache_seconds:
+            return None
+
+    entitlement = db.get_active_entitlement(user_id)
+    if entitlement is not None:
+        entitlement["expires_at"] = _as_utc(entitlement["expires_at"])
+
+    _cache_entitlement(user_id, entitlement, now)
+    return entitlement
+
+
+def _cache_entitlement(user_id: str, entitlement: Optional[Dict], checked_at: datetime):
+    max_users = int(os.getenv("ENTITLEMENT_CACHE_MAX_USERS", "100000"))
+    with _lock:
+        _cache[user_id] = (entitlement, checked_at)
+        _cache.move_to_end(user_id)
+        while len(_cache) > max_users:
+            _cache.popitem(last=False)
+
+
+# Grant a time pass to the user. Passes bought while another one is active
+# extend it instead of overlapping.
+def grant_pass(user_id: str, offer: Dict) -> Dict:
+    now = datetime.now(timezone.utc)
+    # Read from the database, the cache may be stale or miss an extension made
+    # by another worker. This is the webhook path, not the hot path.
+    current = db.get_active_entitlement(user_id)
+    starts_at = _as_utc(current["expires_at"]) if current else now
+
+    entitlement = db.create_entitlement(
+        user_id,
+        offer["offer_id"],
+        starts_at + timedelta(seconds=offer["duration"])
+    )
+    entitlement["expires_at"] = _as_utc(entitlement["expires_at"])
+
+    _cache_entitlement(user_id, entitlement, now)
+    return entitlement
+
+
+# Apply a paid offer to the user: grant the time pass or add the credits.
+# Returns the number of credits granted.
+def fulfill_offer(user_id: str, offer: Dict) -> int:
+    if offer["type"] == "time-pass":
+        grant_pass(user_id, offer)
+        return 0
+
+    db.update_user_credits(user_id, offer["balance"])
+    return offer["balance"]
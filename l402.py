@@ -2,9 +2,8 @@ from datetime import datetime, timedelta, timezone
 import os
 import logging
 from offers import api_offers, get_offer_by_id
-from stripe_payments import create_stripe_session
-from lightning_payments import create_lightning_invoice
-from coinbase_payments import create_coinbase_charge
+
+logger = logging.getLogger(__name__)
 
 
 L402_VERSION = "0.2.1"
@@ -71,14 +70,17 @@ def create_new_payment_request(user_id, offer_id, payment_method, chain=None, as
         "expires_at": expiry.isoformat(),
     }
     
+    # Payment providers are imported on use, only enabled ones are ever loaded
     try:
         if payment_method == "lightning":
-            logging.info(f"Creating Lightning payment request for offer {offer_id}")
+            from lightning_payments import create_lightning_invoice
+            logger.info("Creating Lightning payment request for offer %s", offer_id)
             response["payment_request"]["lightning_invoice"] = create_lightning_invoice(user_id, offer, expiry)
 
         elif payment_method == "onchain":
+            from coinbase_payments import create_coinbase_charge
             network_id = "8453"  # base-mainnet
-            logging.info(f"Creating onchain payment request for offer {offer_id}")
+            logger.info("Creating onchain payment request for offer %s", offer_id)
             payment_details = create_coinbase_charge(user_id, offer, expiry)
             response["payment_request"]["checkout_url"] = payment_details["checkout_url"]
             response["payment_request"]["address"] = payment_details["contract_addresses"][network_id]
@@ -86,11 +88,12 @@ def create_new_payment_request(user_id, offer_id, payment_method, chain=None, as
             response["payment_request"]["chain"] = chain
 
         elif payment_method == "credit_card":
-            logging.info(f"Creating Stripe payment link for offer {offer_id}")
+            from stripe_payments import create_stripe_session
+            logger.info("Creating Stripe payment link for offer %s", offer_id)
             response["payment_request"]["checkout_url"] = create_stripe_session(user_id, offer, expiry)
     
         return response
 
     except Exception as e:
-        logging.error(f"Failed to create payment request for offer {offer_id} with payment method {payment_method}: {e}")
+        logger.error("Failed to create payment request for offer %s with payment method %s: %s", offer_id, payment_method, e)
         raise ValueError(f"Failed to create payment request")
@@ -6,6 +6,9 @@ from database import db
 from flask import request
 import requests
 from offers import get_offer_by_id
+from entitlements import fulfill_offer
+
+logger = logging.getLogger(__name__)
 
 
 _price_cache = {"timestamp": datetime.min.replace(tzinfo=timezone.utc), "price": 0}
@@ -16,9 +19,9 @@ def get_usd_amount_in_sats(cents):
             btc_price = float(response.json()["result"]["XXBTZUSD"]["c"][0])
             sats_per_cent = 100_000_000 * 0.01 / btc_price  # sats per bitcoin (/100_000_000)  but then it's in cents (/00) but then it is in milisats (*000)
             _price_cache.update(timestamp=datetime.now(timezone.utc), price=sats_per_cent)
-            logging.info(f"Updated BTC price cache. Current price: ${btc_price:,.2f}")
+            logger.info("Updated BTC price cache. Current price: $%.2f", btc_price)
         except Exception as e:
-            logging.error(f"Error fetching BTC price: {str(e)}")
+            logger.error("Error fetching BTC price: %s", e)
             raise
     return int(cents * _price_cache["price"])
 
@@ -36,7 +39,7 @@ def init_lightning_webhook_routes(app):
             )
 
             if event.event_type == lightspark.WebhookEventType.PAYMENT_FINISHED:
-                logging.info(f"Payment finished event: {event}")
+                logger.info("Payment finished event for entity %s", event.entity_id)
                 client = lightspark.LightsparkSyncClient(
                     api_token_client_id=os.environ.get("LIGHTSPARK_API_TOKEN_CLIENT_ID"),
                     api_token_client_secret=os.environ.get("LIGHTSPARK_API_TOKEN_CLIENT_SECRET"),
@@ -48,12 +51,12 @@ def init_lightning_webhook_routes(app):
                 # Get the payment entity
                 payment = client.get_entity(entity_id, entity_class)
 
-                logging.info(f"Payment details: {payment}")
+                logger.info("Payment %s for payment request %s", payment.id, payment.payment_request_id)
 
                 # Load payment request data
                 payment_request = db.get_payment_request(payment.payment_request_id)
                 if not payment_request:
-                    logging.error(f"Invalid payment request: {payment.payment_request_id}")
+                    logger.error("Invalid payment request: %s", payment.payment_request_id)
                     return {}, 200
                 
                 payment_request_id = payment_request['id']
@@ -63,26 +66,26 @@ def init_lightning_webhook_routes(app):
                 # Load offer details to get credits amount
                 offer = get_offer_by_id(offer_id)
                 if not offer:
-                    logging.error(f"Invalid offer: {offer_id}")
+                    logger.error("Invalid offer: %s", offer_id)
                     return {}, 200
                 
-                # Update user credits based on offer
-                db.update_user_credits(user_id, offer['balance'])
+                # Grant the credits or time pass of the offer
+                credits = fulfill_offer(user_id, offer)
                 
                 # Record the completed payment
                 db.record_payment(
                     payment_request_id=payment_request_id,
-                    credits=offer['balance'],
+                    credits=credits,
                     amount=offer['amount'],
                     currency=offer['currency'],
                 )
             
             else:
-                logging.info(f"Unhandled event type: {event.event_type}")
+                logger.info("Unhandled event type: %s", event.event_type)
 
             return {}, 200
         except Exception as e:
-            logging.error(f"Error handling Lightspark webhook({request.data}): {str(e)}")
+            logger.error("Error handling Lightspark webhook: %s", e)
             return {}, 200
 
 
@@ -102,8 +105,8 @@ def create_lightning_invoice(user_id, offer, expiry):
         expiry_secs=expiry_secs
     )
 
-    db.create_payment_request(invoice.id, user_id, offer["offer_id"])
-    logging.info(f"Created Lightning invoice {invoice.id} for user {user_id}")
+    db.create_payment_request(invoice.id, user_id, offer["offer_id"], expiry)
+    logger.info("Created Lightning invoice %s for user %s", invoice.id, user_id)
 
     return invoice.data.encoded_payment_request
 
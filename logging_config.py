@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+import logging
+import logging.handlers
+from typing import Dict
+from flask import request, g
+
+# Logging pipeline. Log calls only put the record on an in-memory queue, a
+# background listener thread formats it as a JSON line and writes it to stdout,
+# so formatting and write syscalls stay off the request path. High-volume
+# loggers can be sampled with LOG_SAMPLE_RATES, e.g. "access=0.01,main=0.1";
+# warnings and errors are always kept.
+
+# Attributes every LogRecord has, anything else was passed with extra=
+_record_attributes = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _record_attributes:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records below WARNING, per logger name."""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def get_sample_rate(self, name: str) -> float:
+        # The most specific configured logger wins, "a.b" before "a"
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        sample_rate = self.get_sample_rate(record.name)
+        return sample_rate >= 1 or random.random() < sample_rate
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """Queue listener that waits for room for its stop sentinel, so it always stops and flushes."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that defers formatting to the listener. When the queue is
+    full, records below ERROR are dropped and counted, errors wait for room so
+    they are never lost.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The queue never leaves the process, so the record doesn't need to be
+        # formatted (or made picklable) here. The listener formats it.
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.ERROR:
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+
+        self.report_dropped()
+
+    # Log how many records were dropped since the last report, once the queue
+    # has room again. Never blocks, the count is kept for the next report.
+    def report_dropped(self):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return
+
+        try:
+            self.queue.put_nowait(logging.makeLogRecord({
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": "Dropped %s log records, the log queue was full",
+                "args": (dropped,),
+            }))
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += dropped
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    sample_rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            sample_rates[name.strip()] = float(rate)
+    return sample_rates
+
+
+def configure_logging():
+    log_queue = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = FlushingQueueListener(log_queue, stream_handler)
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))))
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+    root.handlers = [queue_handler]
+
+    listener.start()
+    atexit.register(listener.stop)
+
+
+# Access log written by the app through the logging pipeline, in place of the
+# synchronous gunicorn access log
+def init_access_log(app):
+    access_logger = logging.getLogger("access")
+
+    @app.before_request
+    def start_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        if access_logger.isEnabledFor(logging.INFO):
+            started_at = g.get("request_started_at")
+            access_logger.info(
+                "%s %s %s", request.method, request.path, response.status_code,
+                extra={
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round((time.perf_counter() - started_at) * 1000, 2) if started_at else None,
+                }
+            )
+        return response
@@ -1,34 +1,49 @@
+import time
+_start_time = time.perf_counter()
+
 from dotenv import load_dotenv
-from flask import Flask, request, render_template
+from flask import Flask, Response, request, render_template
 import functools
+from datetime import date, timedelta
 import stock_data
 import l402
-import stripe_payments
-import lightning_payments
-import coinbase_payments
 import offers
+import profiling
+import rate_limit
+import entitlements
+import sweeper
+import logging_config
 from database import db
 import logging
+import hmac
 import os
 load_dotenv()
 
 app = Flask(__name__)
-logging.basicConfig(
-    level=os.getenv('LOG_LEVEL', 'INFO'),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]
-)
+logging_config.configure_logging()
 logger = logging.getLogger(__name__)
 
-stripe_payments.init_stripe_webhook_routes(app)  # For Stripe payments
-lightning_payments.init_lightning_webhook_routes(app)  # For Lightning payments
-coinbase_payments.init_coinbase_webhook_routes(app)  # For Coinbase payments
+# Payment providers are only imported when enabled, so workers don't pay the
+# import time and memory of SDKs they never use.
+if l402.is_payment_method_enabled("credit_card"):
+    import stripe_payments
+    stripe_payments.init_stripe_webhook_routes(app)  # For Stripe payments
+if l402.is_payment_method_enabled("lightning"):
+    import lightning_payments
+    lightning_payments.init_lightning_webhook_routes(app)  # For Lightning payments
+if l402.is_payment_method_enabled("onchain"):
+    import coinbase_payments
+    coinbase_payments.init_coinbase_webhook_routes(app)  # For Coinbase payments
+profiling.init_profiling(app)  # Opt-in request profiling
+sweeper.start_sweeper()  # Archive expired payment requests
+logging_config.init_access_log(app)  # Sampled, non-blocking access log
 
 
 def require_auth(f):
     """
     Authentication middleware that checks if the request has a valid token.
     All protected endpoints must include a 'Bearer <token>' in Authorization header.
+    Requests over the token's rate limit are rejected with a 429 and Retry-After.
     """
 
     @functools.wraps(f)
@@ -44,11 +59,37 @@ def require_auth(f):
         if not user_data:
             return {'error': 'invalid token'}, 401
 
+        # Throttle clients that exceed the rate limit of their tier
+        retry_after = rate_limit.admit(user_id, user_data['id'])
+        if retry_after is not None:
+            return {'error': 'Too many requests'}, 429, {'Retry-After': str(retry_after)}
+
         return f(user_data, *args, **kwargs)
 
     return decorated
 
 
+def require_admin(f):
+    """
+    Admin middleware that checks the request carries the configured ADMIN_TOKEN
+    as 'Bearer <token>'. Admin endpoints are disabled when ADMIN_TOKEN is not set.
+    """
+
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        admin_token = os.getenv('ADMIN_TOKEN')
+        if not admin_token:
+            return {'error': 'not found'}, 404
+
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header, f'Bearer {admin_token}'):
+            return {'error': 'Missing or invalid authorization header'}, 401
+
+        return f(*args, **kwargs)
+
+    return decorated
+
+
 # Create a new user account
 # Returns: User data including an authentication token for future requests
 @app.route('/signup')
@@ -57,6 +98,35 @@ def signup():
     return user_data
 
 
+# Create user accounts in bulk, e.g. for a fleet of agents
+# Requires: Authorization header with the admin token
+# Body: {"count": <number of accounts>, "credits": <initial credits per account, default 1>}
+# Returns: {"users": [...]} with the data of every account created, streamed
+@app.route('/signup/batch', methods=['POST'])
+@require_admin
+def signup_batch():
+    body = request.get_json(silent=True) or {}
+    count = body.get('count')
+    credits = body.get('credits', 1)
+    max_count = int(os.getenv('SIGNUP_BATCH_MAX', '10000'))
+
+    if type(count) is not int or not 1 <= count <= max_count:
+        return {'error': f'count must be an integer between 1 and {max_count}'}, 400
+    if type(credits) is not int or credits < 0:
+        return {'error': 'credits must be a non-negative integer'}, 400
+
+    users = db.create_users(count, credits)
+    logger.info("Created %s users in batch", count)
+
+    def generate():
+        yield '{"users": ['
+        for i, user in enumerate(users):
+            yield (',' if i else '') + app.json.dumps(user)
+        yield ']}'
+
+    return Response(generate(), mimetype='application/json')
+
+
 # User information
 # Requires: Authorization header with Bearer token
 # Returns: User data if token is valid
@@ -69,35 +139,97 @@ def info(user_data):
 #  Request ticker data
 # Requires:
 #   - Authorization header with Bearer token
-#   - User must have available credits
+#   - User must have available credits or an active time pass
 #   - Valid ticker symbol in URL
 # Returns: Ticker data or error if no credits
 @app.route('/ticker/<ticker_symbol>')
 @require_auth
 def ticker(user_data, ticker_symbol):
-    logger.info(f"Received request for ticker {ticker_symbol} from user {user_data['id']}")
-    
-    if user_data['credits'] <= 0:
-        logger.warning(f"User {user_data['id']} has insufficient credits")
+    logger.info("Received request for ticker %s from user %s", ticker_symbol, user_data['id'])
+
+    # Calls covered by a time pass are not charged any credits
+    entitlement = entitlements.get_active_entitlement(user_data['id'])
+    if entitlement is None and user_data['credits'] <= 0:
+        logger.info("User %s has insufficient credits", user_data['id'])
         response = l402.create_new_response(user_data['id'])
         return response, 402
 
     try:
         ticker_data = stock_data.get_stock_data(ticker_symbol)
         if not ticker_data:
-            logger.error(f"Failed to fetch data for ticker {ticker_symbol}")
+            logger.error("Failed to fetch data for ticker %s", ticker_symbol)
             return {'error': f'unable to fetch stock data for ticker {ticker_symbol}'}, 400
         
-        logger.info(f"Successfully fetched data for ticker {ticker_symbol}")
-        db.update_user_credits(user_data['id'], -1)
+        logger.info("Successfully fetched data for ticker %s", ticker_symbol)
+        if entitlement is None:
+            db.update_user_credits(user_data['id'], -1)
         return ticker_data
+    except stock_data.UpstreamBusyError as e:
+        logger.info("Stock data service busy while fetching %s", ticker_symbol)
+        return {'error': 'Stock data service is busy. Please try again later.'}, 503, {'Retry-After': str(e.retry_after)}
     except ConnectionError:
-        logger.error(f"Connection error while fetching {ticker_symbol}")
+        logger.error("Connection error while fetching %s", ticker_symbol)
         return {'error': 'Unable to connect to stock data service. Please try again later.'}, 503
     except Exception as e:
-        logger.exception(f"Unexpected error while fetching {ticker_symbol}")
+        logger.exception("Unexpected error while fetching %s", ticker_symbol)
         return {'error': 'Failed to fetch stock data'}, 500
 
+#  Request historical daily prices (OHLCV) as a stream
+# Requires:
+#   - Authorization header with Bearer token
+#   - User must have enough credits for the rows returned or an active time pass
+#   - Valid ticker symbol in URL
+# Query parameters:
+#   - start, end: date range (YYYY-MM-DD), defaults to the last year
+#   - format: ndjson (default) or csv
+# Returns: Streamed price history, 1 credit per HISTORY_ROWS_PER_CREDIT rows
+@app.route('/ticker/<ticker_symbol>/history')
+@require_auth
+def ticker_history(user_data, ticker_symbol):
+    # numpy and the price cache are only loaded once history is requested
+    import price_history
+
+    ticker_symbol = ticker_symbol.upper()
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        return {'error': f'unsupported format {output_format}'}, 400
+
+    try:
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else date.today()
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else end - timedelta(days=365)
+    except ValueError:
+        return {'error': 'start and end must be dates in YYYY-MM-DD format'}, 400
+
+    entitlement = entitlements.get_active_entitlement(user_data['id'])
+    if entitlement is None and user_data['credits'] <= 0:
+        logger.info("User %s has insufficient credits", user_data['id'])
+        return l402.create_new_response(user_data['id']), 402
+
+    try:
+        history = price_history.get_price_history(ticker_symbol, start, end)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except stock_data.UpstreamBusyError as e:
+        logger.info("Stock data service busy while fetching history for %s", ticker_symbol)
+        return {'error': 'Stock data service is busy. Please try again later.'}, 503, {'Retry-After': str(e.retry_after)}
+
+    if history is None:
+        return {'error': f'unable to fetch price history for ticker {ticker_symbol}'}, 400
+
+    # Charge upfront, the response is streamed
+    cost = price_history.get_credit_cost(history)
+    if entitlement is None:
+        if user_data['credits'] < cost:
+            logger.info("User %s has insufficient credits for %s credits of history", user_data['id'], cost)
+            return l402.create_new_response(user_data['id']), 402
+        db.update_user_credits(user_data['id'], -cost)
+
+    headers = {'X-Row-Count': str(len(history)), 'X-Credits-Charged': str(cost if entitlement is None else 0)}
+    if output_format == 'csv':
+        return Response(history.iter_csv(), mimetype='text/csv', headers=headers)
+    return Response(history.iter_ndjson(), mimetype='application/x-ndjson', headers=headers)
+
+
 @app.route('/l402/payment-request', methods=['POST'])
 def payment_request():
     try:
@@ -132,14 +264,47 @@ def payment_request():
     except ValueError as e:
         return {'error': str(e)}, 400
     except Exception as e:
-        logger.exception(f"Unexpected error while creating payment request")
+        logger.exception("Unexpected error while creating payment request")
         return {'error': 'Failed to create payment request'}, 500
 
 
+# List recently captured request profiles
+# Requires: Authorization header with the admin token
+@app.route('/admin/profiles')
+@require_admin
+def list_profiles():
+    return {'profiles': profiling.list_profiles()}
+
+
+# Fetch a captured profile in collapsed-stack (flamegraph) format
+# Requires: Authorization header with the admin token
+@app.route('/admin/profiles/<profile_id>')
+@require_admin
+def get_profile(profile_id):
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        return {'error': f'profile {profile_id} does not exist'}, 404
+    return Response(profile, mimetype='text/plain')
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+
+# Resident memory of the current process in MB
+def get_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+        # Peak RSS, reported in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+logger.info("App loaded in %.0f ms, RSS %.1f MB", (time.perf_counter() - _start_time) * 1000, get_rss_mb())
+
 if __name__ == '__main__':
     debug = os.environ.get("DEBUG")=="true"
     app.run(host='0.0.0.0', port=5001, debug=debug)
@@ -4,8 +4,10 @@ from typing import Optional, Dict
 # These can be used for different payment scenarios:
 # - One-time payments for specific endpoint access
 # - Subscription tier upgrades
-# - Credit-based API access (current implementation)
-# Each offer specifies the price, amount of credits, and supported payment methods.
+# - Credit-based API access ("top-up" offers)
+# - Unlimited API access over a time window ("time-pass" offers)
+# Each offer specifies the price, amount of credits or pass duration (in seconds),
+# and supported payment methods.
 api_offers = [
     {
         "offer_id": "offer_c668e0c0",
@@ -36,6 +38,26 @@ api_offers = [
         "type": "top-up",
         "balance": 750,
         "payment_methods": ["lightning", "onchain", "credit_card"]
+    },
+    {
+        "offer_id": "offer_5d2e91a7",
+        "title": "1 Hour Unlimited Pass",
+        "description": "Unlimited API access for 1 hour",
+        "amount": 199,
+        "currency": "USD",
+        "type": "time-pass",
+        "duration": 3600,
+        "payment_methods": ["lightning", "onchain", "credit_card"]
+    },
+    {
+        "offer_id": "offer_e4b07c3f",
+        "title": "24 Hours Unlimited Pass",
+        "description": "Unlimited API access for 24 hours",
+        "amount": 999,
+        "currency": "USD",
+        "type": "time-pass",
+        "duration": 86400,
+        "payment_methods": ["lightning", "onchain", "credit_card"]
     }
 ]
 
@@ -46,4 +68,24 @@ def get_offer_by_id(offer_id: str) -> Optional[Dict]:
         if offer["offer_id"] == offer_id:
             return offer
 
-    return None
\ No newline at end of file
+    return None
+
+
+# Rate limits applied to API calls, keyed by the user's active time pass or,
+# without one, the top-up offer the user last paid for. Users that never paid
+# get the default limit. Time passes use this as their optional rate cap.
+# "rate" is the sustained number of requests per second and "burst" the number
+# of requests that can be made at once.
+default_rate_limit = {"rate": 0.5, "burst": 5}
+offer_rate_limits = {
+    "offer_c668e0c0": {"rate": 0.5, "burst": 5},
+    "offer_97bf23f7": {"rate": 2, "burst": 10},
+    "offer_a896b13c": {"rate": 5, "burst": 20},
+    "offer_5d2e91a7": {"rate": 10, "burst": 30},
+    "offer_e4b07c3f": {"rate": 10, "burst": 30},
+}
+
+
+# Get the rate limit for an offer tier
+def get_rate_limit(offer_id: Optional[str]) -> Dict:
+    return offer_rate_limits.get(offer_id, default_rate_limit)
@@ -0,0 +1,263 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+import numpy as np
+from datetime import date, timedelta
+from typing import Optional, Iterator
+from stock_data import upstream_slot, UpstreamBusyError
+
+logger = logging.getLogger(__name__)
+
+# Daily OHLCV prices are cached on disk, one file per symbol. Each file holds a
+# (len(COLUMNS), rows) float64 array so every column is contiguous, and is
+# memory-mapped on read: serving a range only touches the pages it needs and
+# memory stays flat however long the range is. A small JSON file next to it
+# records the date range already fetched, so only missing ranges go upstream.
+# At most PRICE_CACHE_MAX_SYMBOLS symbols are kept, least recently updated go first.
+COLUMNS = ("date", "open", "high", "low", "close", "volume")
+DATE, OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(COLUMNS))
+
+# Number of rows formatted at once while streaming a response
+STREAM_CHUNK_ROWS = 1024
+
+_symbol_pattern = re.compile(r"^[A-Z0-9.^=-]{1,15}$")
+# Fetches are serialized per symbol with a fixed pool of locks, so the number
+# of locks doesn't grow with the number of symbols requested
+_symbol_locks = [threading.Lock() for _ in range(64)]
+
+
+def get_cache_dir() -> str:
+    return os.getenv("PRICE_CACHE_DIR", "price_cache")
+
+
+def _get_symbol_lock(symbol: str) -> threading.Lock:
+    return _symbol_locks[hash(symbol) % len(_symbol_locks)]
+
+
+def _to_days(day: date) -> int:
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+
+def _load_coverage(symbol: str) -> Optional[tuple]:
+    try:
+        with open(os.path.join(get_cache_dir(), f"{symbol}.json"), "r") as f:
+            coverage = json.load(f)
+        return date.fromisoformat(coverage["start"]), date.fromisoformat(coverage["end"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _load_prices(symbol: str) -> Optional[np.ndarray]:
+    try:
+        return np.load(os.path.join(get_cache_dir(), f"{symbol}.npy"), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+
+def _store(symbol: str, prices: np.ndarray, start: date, end: date):
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to temporary files and rename, readers holding a memory map of the
+    # previous file keep reading it untouched. Coverage is written last so a
+    # crash in between only causes a range to be fetched again.
+    prices_path = os.path.join(cache_dir, f"{symbol}.npy")
+    with open(prices_path + ".tmp", "wb") as f:
+        np.save(f, prices)
+    os.replace(prices_path + ".tmp", prices_path)
+
+    coverage_path = os.path.join(cache_dir, f"{symbol}.json")
+    with open(coverage_path + ".tmp", "w") as f:
+        json.dump({"start": start.isoformat(), "end": end.isoformat()}, f)
+    os.replace(coverage_path + ".tmp", coverage_path)
+
+    _evict(cache_dir)
+
+
+# Drop the least recently updated symbols beyond PRICE_CACHE_MAX_SYMBOLS
+def _evict(cache_dir: str):
+    max_symbols = int(os.getenv("PRICE_CACHE_MAX_SYMBOLS", "500"))
+    paths = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir)
+        if name.endswith(".npy")
+    ]
+    if len(paths) <= max_symbols:
+        return
+
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for prices_path in paths[max_symbols:]:
+        # Coverage goes first so it never claims prices that are gone
+        for path in (prices_path[:-len(".npy")] + ".json", prices_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Fetch daily prices from Yahoo Finance for [start, end]
+def _fetch(symbol: str, start: date, end: date) -> np.ndarray:
+    import yfinance as yf
+
+    with upstream_slot():
+        history = yf.Ticker(symbol).history(
+            start=start.isoformat(),
+            end=(end + timedelta(days=1)).isoformat(),  # end is exclusive
+            interval="1d",
+            auto_adjust=False,
+        )
+
+    prices = np.empty((len(COLUMNS), len(history)), dtype=np.float64)
+    if len(history):
+        prices[DATE] = np.array(history.index.date, dtype="datetime64[D]").astype(np.int64)
+        prices[OPEN] = history["Open"].to_numpy()
+        prices[HIGH] = history["High"].to_numpy()
+        prices[LOW] = history["Low"].to_numpy()
+        prices[CLOSE] = history["Close"].to_numpy()
+        prices[VOLUME] = history["Volume"].to_numpy()
+
+    # yfinance fills missing bars with NaN, which is not valid JSON. Rows with
+    # no prices are dropped and a missing volume is reported as 0.
+    prices = prices[:, ~np.isnan(prices[OPEN:CLOSE + 1]).any(axis=0)]
+    prices[VOLUME] = np.nan_to_num(prices[VOLUME])
+    return prices
+
+
+# Make sure the cache covers [start, end], fetching only the missing ranges.
+# Returns whether anything was fetched upstream.
+def _ensure_cached(symbol: str, start: date, end: date) -> bool:
+    # Waiting on another fetch of the symbol counts against the same timeout
+    # as waiting for an upstream slot
+    symbol_lock = _get_symbol_lock(symbol)
+    if not symbol_lock.acquire(timeout=float(os.getenv("YFINANCE_QUEUE_TIMEOUT", "5"))):
+        raise UpstreamBusyError()
+
+    try:
+        coverage = _load_coverage(symbol)
+        cached = _load_prices(symbol)
+        if coverage is None or cached is None:
+            coverage, cached = None, np.empty((len(COLUMNS), 0), dtype=np.float64)
+
+        if coverage is None:
+            missing = [(start, end)]
+            new_start, new_end = None, None
+        else:
+            cached_start, cached_end = coverage
+            missing = []
+            if start < cached_start:
+                missing.append((start, cached_start - timedelta(days=1)))
+            if end > cached_end:
+                missing.append((cached_end + timedelta(days=1), end))
+            new_start, new_end = cached_start, cached_end
+
+        if not missing:
+            return False
+
+        logger.info("Fetching price history for %s: %s", symbol, missing)
+        parts = [cached]
+        for missing_start, missing_end in missing:
+            prices = _fetch(symbol, missing_start, missing_end)
+            # yfinance returns no rows both for unknown symbols and for many
+            # transient failures, so symbols without any data are not cached.
+            # For a known symbol an empty range just has no trading days.
+            if not prices.shape[1] and not any(part.shape[1] for part in parts):
+                continue
+            parts.append(prices)
+            new_start = missing_start if new_start is None else min(new_start, missing_start)
+            new_end = missing_end if new_end is None else max(new_end, missing_end)
+
+        if len(parts) == 1:
+            return True
+
+        prices = np.concatenate(parts, axis=1)
+        _, unique_idx = np.unique(prices[DATE], return_index=True)
+        _store(symbol, prices[:, unique_idx], new_start, new_end)
+        return True
+    finally:
+        symbol_lock.release()
+
+
+class PriceHistory:
+    """A date range of cached daily prices for a symbol."""
+
+    def __init__(self, prices: np.ndarray, fetched_upstream: bool = False):
+        self.prices = prices
+        self.fetched_upstream = fetched_upstream
+
+    def __len__(self):
+        return self.prices.shape[1]
+
+    def _chunks(self) -> Iterator[tuple]:
+        for offset in range(0, len(self), STREAM_CHUNK_ROWS):
+            chunk = self.prices[:, offset:offset + STREAM_CHUNK_ROWS]
+            dates = np.datetime_as_string(chunk[DATE].astype(np.int64).astype("datetime64[D]"))
+            yield zip(
+                dates.tolist(),
+                chunk[OPEN].tolist(),
+                chunk[HIGH].tolist(),
+                chunk[LOW].tolist(),
+                chunk[CLOSE].tolist(),
+                chunk[VOLUME].astype(np.int64).tolist(),
+            )
+
+    def iter_ndjson(self) -> Iterator[str]:
+        for rows in self._chunks():
+            yield "".join(
+                json.dumps(dict(zip(COLUMNS, row))) + "\n"
+                for row in rows
+            )
+
+    def iter_csv(self) -> Iterator[str]:
+        yield ",".join(COLUMNS) + "\n"
+        for rows in self._chunks():
+            yield "".join(
+                f"{day},{open_},{high},{low},{close},{volume}\n"
+                for day, open_, high, low, close, volume in rows
+            )
+
+
+def is_valid_symbol(symbol: str) -> bool:
+    return bool(_symbol_pattern.match(symbol))
+
+
+# Get daily prices for [start, end], or None if they could not be fetched or
+# the symbol has no data at all
+def get_price_history(symbol: str, start: date, end: date) -> Optional[PriceHistory]:
+    if not is_valid_symbol(symbol):
+        raise ValueError(f"invalid ticker symbol {symbol}")
+    if start > end:
+        raise ValueError("start must be before end")
+
+    # Today's bar is still moving, only completed days are served and cached
+    end = min(end, date.today() - timedelta(days=1))
+    if start > end:
+        return PriceHistory(np.empty((len(COLUMNS), 0), dtype=np.float64))
+
+    try:
+        fetched_upstream = _ensure_cached(symbol, start, end)
+    except UpstreamBusyError:
+        raise
+    except Exception as e:
+        logger.error("Error fetching price history from yfinance: %s", e)
+        return None
+
+    prices = _load_prices(symbol)
+    if prices is None:
+        return None
+
+    lo = np.searchsorted(prices[DATE], _to_days(start), side="left")
+    hi = np.searchsorted(prices[DATE], _to_days(end), side="right")
+    return PriceHistory(prices[:, lo:hi], fetched_upstream)
+
+
+# Number of credits charged for a history response. Calls that went upstream
+# cost at least 1 credit, even when the range has no trading days.
+def get_credit_cost(history: PriceHistory) -> int:
+    rows_per_credit = int(os.getenv("HISTORY_ROWS_PER_CREDIT", "250"))
+    cost = math.ceil(len(history) / rows_per_credit)
+    if history.fetched_upstream:
+        return max(cost, 1)
+    return cost
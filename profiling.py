@@ -0,0 +1,197 @@
+import os
+import re
+import sys
+import time
+import hmac
+import random
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Optional, Dict, List
+from uuid import uuid4
+from flask import request, g
+
+logger = logging.getLogger(__name__)
+
+# Opt-in request profiler. A request is profiled when it is picked by the
+# sampling rate or when it carries a valid signature header. While the request
+# runs, a background thread samples the stack of the request's thread and the
+# result is written in collapsed-stack format (one "frame;frame;frame count"
+# line per stack), which can be fed directly to flamegraph.pl or speedscope.
+PROFILE_SIGNATURE_HEADER = "X-Profile-Signature"
+PROFILE_FILE_SUFFIX = ".folded"
+_profile_id_pattern = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+
+def get_profile_dir() -> str:
+    return os.getenv("PROFILE_DIR", "profiles")
+
+
+def is_profile_signature_valid(signature: Optional[str]) -> bool:
+    # The header is "<unix_ts>:<hex HMAC-SHA256 of '<unix_ts>:<path>'>", so a
+    # signed header only works for one endpoint and for a short time.
+    secret = os.getenv("PROFILE_SECRET")
+    if not secret or not signature or ":" not in signature:
+        return False
+
+    timestamp, signature = signature.split(":", 1)
+    try:
+        age = abs(time.time() - int(timestamp))
+    except ValueError:
+        return False
+    if age > int(os.getenv("PROFILE_SIGNATURE_MAX_AGE", "300")):
+        return False
+
+    expected_sig = hmac.new(
+        secret.encode('utf-8'),
+        f"{timestamp}:{request.path}".encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(signature, expected_sig)
+
+
+def should_profile_request(sample_rate: float) -> bool:
+    if is_profile_signature_valid(request.headers.get(PROFILE_SIGNATURE_HEADER)):
+        return True
+
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class StackSampler:
+    """Samples the stack of a single thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+
+def write_profile(root_frame: str, stacks: Counter) -> str:
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+
+    profile_id = f"{int(time.time() * 1000)}-{uuid4().hex[:8]}"
+    path = os.path.join(profile_dir, profile_id + PROFILE_FILE_SUFFIX)
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{root_frame};{stack} {count}\n")
+
+    # Keep the on-disk ring bounded by dropping the oldest profiles.
+    max_files = int(os.getenv("PROFILE_MAX_FILES", "50"))
+    for stale_id in [p["id"] for p in list_profiles()][max_files:]:
+        try:
+            os.remove(os.path.join(profile_dir, stale_id + PROFILE_FILE_SUFFIX))
+        except FileNotFoundError:
+            pass
+
+    return profile_id
+
+
+# List stored profiles, newest first
+def list_profiles() -> List[Dict]:
+    profile_dir = get_profile_dir()
+    if not os.path.isdir(profile_dir):
+        return []
+
+    profiles = []
+    for name in os.listdir(profile_dir):
+        profile_id = name[:-len(PROFILE_FILE_SUFFIX)]
+        if not name.endswith(PROFILE_FILE_SUFFIX) or not _profile_id_pattern.match(profile_id):
+            continue
+        profiles.append({
+            "id": profile_id,
+            "created_at": int(profile_id.split("-")[0]) / 1000,
+            "size": os.path.getsize(os.path.join(profile_dir, name)),
+        })
+
+    profiles.sort(key=lambda p: p["id"], reverse=True)
+    return profiles
+
+
+# Get the collapsed-stack output of a stored profile
+def get_profile(profile_id: str) -> Optional[str]:
+    if not _profile_id_pattern.match(profile_id):
+        return None
+
+    try:
+        with open(os.path.join(get_profile_dir(), profile_id + PROFILE_FILE_SUFFIX), 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def finish_profile(profiler: StackSampler, root_frame: str):
+    profiler.stop()
+    if not profiler.stacks:
+        return
+
+    try:
+        profile_id = write_profile(root_frame, profiler.stacks)
+        logger.info("Stored profile %s for %s", profile_id, root_frame)
+    except OSError as e:
+        logger.error("Failed to store profile for %s: %s", root_frame, e)
+
+
+def init_profiling(app):
+    interval = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+    @app.before_request
+    def start_profiler():
+        if not should_profile_request(sample_rate):
+            return
+
+        g.profiler = StackSampler(threading.get_ident(), interval)
+        g.profiler.start()
+
+    @app.after_request
+    def profile_streamed_response(response):
+        # Streamed bodies are generated after the request is torn down, keep
+        # sampling until the body is fully sent so encoding shows up too.
+        if not response.is_streamed or g.get('profiler') is None:
+            return response
+
+        profiler = g.pop('profiler')
+        root_frame = f"{request.method} {request.path}"
+        body = response.response
+
+        def profiled_body():
+            try:
+                yield from body
+            finally:
+                finish_profile(profiler, root_frame)
+
+        response.response = profiled_body()
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+
+        finish_profile(profiler, f"{request.method} {request.path}")
@@ -0,0 +1,92 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict
+from database import db
+from offers import api_offers, get_rate_limit
+from entitlements import get_active_entitlement
+
+# In-memory admission control for API calls. Each bearer token gets a token
+# bucket sized by the offer tier (or time pass) of its user, so a single client
+# in a retry loop is throttled without affecting the others.
+#
+# Settings, read on each call so values from .env apply:
+# - RATE_LIMIT_MAX_TRACKED_TOKENS: number of buckets kept, least recently used go first
+# - RATE_LIMIT_TIER_REFRESH_SECONDS: how often the tier of a token is re-resolved,
+#   so purchases raise the limit
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.resolved_at = self.updated_at
+
+    def configure(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, float(burst))
+        self.resolved_at = time.monotonic()
+
+    # Take a token from the bucket. Returns 0 when the call is admitted,
+    # otherwise the number of seconds until a token is available.
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+_buckets = OrderedDict()
+_lock = threading.Lock()
+
+
+def resolve_rate_limit(user_id: str) -> Dict:
+    # An active time pass sets the tier, otherwise the last paid top-up does.
+    # Expired passes are skipped so their cap ends with them.
+    entitlement = get_active_entitlement(user_id)
+    if entitlement is not None:
+        return get_rate_limit(entitlement["offer_id"])
+
+    time_pass_offer_ids = [offer["offer_id"] for offer in api_offers if offer["type"] == "time-pass"]
+    return get_rate_limit(db.get_last_paid_offer_id(user_id, time_pass_offer_ids))
+
+
+# Admit an API call for the given token. Returns None when the call is
+# admitted, otherwise the number of seconds the client should wait (Retry-After).
+def admit(token: str, user_id: str) -> Optional[int]:
+    with _lock:
+        bucket = _buckets.get(token)
+        if bucket is not None:
+            _buckets.move_to_end(token)
+
+    now = time.monotonic()
+    tier_refresh_seconds = int(os.getenv("RATE_LIMIT_TIER_REFRESH_SECONDS", "60"))
+    if bucket is None or now - bucket.resolved_at > tier_refresh_seconds:
+        # Resolve the tier outside the lock, it needs a database read.
+        limit = resolve_rate_limit(user_id)
+        with _lock:
+            bucket = _buckets.get(token)
+            if bucket is None:
+                bucket = TokenBucket(limit["rate"], limit["burst"])
+                _buckets[token] = bucket
+                max_tracked_tokens = int(os.getenv("RATE_LIMIT_MAX_TRACKED_TOKENS", "100000"))
+                while len(_buckets) > max_tracked_tokens:
+                    _buckets.popitem(last=False)
+            else:
+                bucket.configure(limit["rate"], limit["burst"])
+
+    with _lock:
+        wait = bucket.take()
+
+    if wait == 0:
+        return None
+    return max(1, math.ceil(wait))
@@ -1,10 +1,65 @@
-import yfinance as yf
 from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Optional
+import threading
 import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 # Cache to store results with timestamps
 _cache = {}
 
+# Upstream concurrency limits. At most YFINANCE_MAX_CONCURRENCY fetches run at
+# once and at most YFINANCE_MAX_QUEUE requests wait for a slot, each for up to
+# YFINANCE_QUEUE_TIMEOUT seconds. Anything beyond that is rejected right away
+# instead of piling up on the worker. Settings are read on first use, after
+# the app has loaded its .env file.
+_upstream_slots = None
+_waiting = 0
+_waiting_lock = threading.Lock()
+
+
+class UpstreamBusyError(Exception):
+    def __init__(self, retry_after: Optional[int] = None):
+        super().__init__("Stock data service is busy")
+        if retry_after is None:
+            retry_after = int(os.getenv("YFINANCE_RETRY_AFTER", "5"))
+        self.retry_after = retry_after
+
+
+def get_upstream_slots() -> threading.BoundedSemaphore:
+    global _upstream_slots
+    with _waiting_lock:
+        if _upstream_slots is None:
+            _upstream_slots = threading.BoundedSemaphore(int(os.getenv("YFINANCE_MAX_CONCURRENCY", "4")))
+        return _upstream_slots
+
+
+# Hold one of the upstream fetch slots, or raise UpstreamBusyError when the
+# wait queue is full or no slot frees up in time.
+@contextmanager
+def upstream_slot():
+    global _waiting
+    upstream_slots = get_upstream_slots()
+    if not upstream_slots.acquire(blocking=False):
+        with _waiting_lock:
+            if _waiting >= int(os.getenv("YFINANCE_MAX_QUEUE", "16")):
+                raise UpstreamBusyError()
+            _waiting += 1
+        try:
+            acquired = upstream_slots.acquire(timeout=float(os.getenv("YFINANCE_QUEUE_TIMEOUT", "5")))
+        finally:
+            with _waiting_lock:
+                _waiting -= 1
+        if not acquired:
+            raise UpstreamBusyError()
+
+    try:
+        yield
+    finally:
+        upstream_slots.release()
+
 # Get the ticker's data from Yahoo Finance
 def get_stock_data(ticker):
     # Check cache first
@@ -13,38 +68,42 @@ def get_stock_data(ticker):
         if datetime.now() - cached_time < timedelta(minutes=1):
             return cached_data
 
-    try:
-        stock = yf.Ticker(ticker)
-        financials = stock.financials
-        info = stock.info
-        if financials.empty:
-            return None
-        financial_data = []
-        for date, data in financials.items():
-            financial_data.append({
-                "fiscalDateEnding":
-                date.strftime("%Y-%m-%d"),
-                "totalRevenue":
-                float(data.get("Total Revenue", 0)),
-                "grossProfit":
-                float(data.get("Gross Profit", 0)),
-                "netIncome":
-                float(data.get("Net Income", 0))
-            })
-        additional_data = {
-            "eps": float(info.get("trailingEps", 0)),
-            "pe_ratio": float(info.get("trailingPE", 0)),
-            "current_price": float(info.get("currentPrice", 0))
-        }
-        result = {
-            "financial_data":
-            financial_data[:4],  # Return only the last 4 quarters
-            "additional_data": additional_data
-        }
+    # yfinance pulls in pandas, import it on first fetch rather than at startup
+    import yfinance as yf
+
+    with upstream_slot():
+        try:
+            stock = yf.Ticker(ticker)
+            financials = stock.financials
+            info = stock.info
+            if financials.empty:
+                return None
+            financial_data = []
+            for date, data in financials.items():
+                financial_data.append({
+                    "fiscalDateEnding":
+                    date.strftime("%Y-%m-%d"),
+                    "totalRevenue":
+                    float(data.get("Total Revenue", 0)),
+                    "grossProfit":
+                    float(data.get("Gross Profit", 0)),
+                    "netIncome":
+                    float(data.get("Net Income", 0))
+                })
+            additional_data = {
+                "eps": float(info.get("trailingEps", 0)),
+                "pe_ratio": float(info.get("trailingPE", 0)),
+                "current_price": float(info.get("currentPrice", 0))
+            }
+            result = {
+                "financial_data":
+                financial_data[:4],  # Return only the last 4 quarters
+                "additional_data": additional_data
+            }
         
-        # Store in cache with current timestamp
-        _cache[ticker] = (datetime.now(), result)
-        return result
-    except Exception as e:
-        logging.error(f"Error fetching data from yfinance: {e}")
-        return None
\ No newline at end of file
+            # Store in cache with current timestamp
+            _cache[ticker] = (datetime.now(), result)
+            return result
+        except Exception as e:
+            logger.error("Error fetching data from yfinance: %s", e)
+            return None
\ No newline at end of file
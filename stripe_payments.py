@@ -5,6 +5,9 @@ from flask import request
 from database import db
 from uuid import uuid4
 from offers import get_offer_by_id
+from entitlements import fulfill_offer
+
+logger = logging.getLogger(__name__)
 
 
 def init_stripe_webhook_routes(app):
@@ -27,18 +30,18 @@ def init_stripe_webhook_routes(app):
                 metadata = session.get('metadata', {})
                 # Check metadata app_id
                 if metadata.get('app_id') != os.environ.get("APP_ID"):
-                    logger.error(f"Invalid app_id in webhook metadata: {metadata.get('app_id')}")
+                    logger.error("Invalid app_id in webhook metadata: %s", metadata.get('app_id'))
                     return {}, 200
 
                 payment_request_id = metadata.get('payment_request')
                 if not payment_request_id:
-                    logging.error(f"Missing payment request ID: {event}")
+                    logger.error("Missing payment request ID in event %s", event['id'])
                     return {}, 200
                 
                 # Load payment request data
                 payment_request = db.get_payment_request(payment_request_id)
                 if not payment_request:
-                    logging.error(f"Invalid payment request: {payment_request_id}")
+                    logger.error("Invalid payment request: %s", payment_request_id)
                     return {}, 200
                     
                 user_id = payment_request['user_id']
@@ -47,16 +50,16 @@ def init_stripe_webhook_routes(app):
                 # Load offer details to get credits amount
                 offer = get_offer_by_id(offer_id)
                 if not offer:
-                    logging.error(f"Invalid offer: {offer_id}")
+                    logger.error("Invalid offer: %s", offer_id)
                     return {}, 200
                 
-                # Update user credits based on offer
-                db.update_user_credits(user_id, offer['balance'])
+                # Grant the credits or time pass of the offer
+                credits = fulfill_offer(user_id, offer)
                 
                 # Record the completed payment
                 db.record_payment(
                     payment_request_id=payment_request_id,
-                    credits=offer['balance'],
+                    credits=credits,
                     amount=offer['amount'],
                     currency=offer['currency'],
                 )
@@ -64,7 +67,7 @@ def init_stripe_webhook_routes(app):
             return {'status': 'success'}, 200
             
         except Exception as e:
-            logging.error(f"Error handling Stripe webhook: {e}")
+            logger.error("Error handling Stripe webhook: %s", e)
             return {}, 200
 
 stripe_payment_links = {
@@ -78,10 +81,10 @@ def create_stripe_session(user_id, offer, expiry):
     try:
         # Verify Stripe configuration
         if not stripe.api_key:
-            logging.error("Stripe API key not set")
+            logger.error("Stripe API key not set")
             return None
 
-        db.create_payment_request(payment_request, user_id, offer["offer_id"])
+        db.create_payment_request(payment_request, user_id, offer["offer_id"], expiry)
         
         session = stripe.checkout.Session.create(
             mode="payment",
@@ -110,8 +113,8 @@ def create_stripe_session(user_id, offer, expiry):
         return session.url
 
     except stripe.error.StripeError as e:
-        logging.error(f"Stripe error: {e}")
+        logger.error("Stripe error: %s", e)
         return None
     except Exception as e:
-        logging.error(f"Unexpected error creating Stripe session: {e}")
+        logger.error("Unexpected error creating Stripe session: %s", e)
         return None
@@ -0,0 +1,67 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Background sweeper for payment requests. Most payment requests are never
+# paid, once expired they are moved in batches to the archive database so the
+# payment_requests table and its index stay small, and the freed pages are
+# released with an incremental vacuum.
+#
+# Every process importing the app starts a sweeper thread, but only the one
+# holding the sweeper lock file sweeps. If that process exits, the lock is
+# released and another process takes over on its next interval.
+
+
+def sweep_expired_payment_requests(grace_minutes: int, batch_size: int, vacuum_pages: int) -> int:
+    # The grace period leaves room for payments confirmed right after expiry
+    expired_before = datetime.now(timezone.utc) - timedelta(minutes=grace_minutes)
+
+    total = 0
+    while True:
+        archived = db.archive_expired_payment_requests(expired_before, batch_size)
+        total += archived
+        if archived < batch_size:
+            break
+        # Let webhooks and API calls grab the write lock between batches
+        time.sleep(0.1)
+
+    if total:
+        db.incremental_vacuum(vacuum_pages)
+        logger.info("Archived %s expired payment requests", total)
+    return total
+
+
+def start_sweeper():
+    if os.getenv("SWEEPER_ENABLED", "true").lower() != "true":
+        return
+
+    interval = int(os.getenv("SWEEPER_INTERVAL_SECONDS", "300"))
+    grace_minutes = int(os.getenv("SWEEPER_GRACE_MINUTES", "60"))
+    batch_size = int(os.getenv("SWEEPER_BATCH_SIZE", "500"))
+    vacuum_pages = int(os.getenv("SWEEPER_VACUUM_PAGES", "1000"))
+
+    def run():
+        lock_file = open(db.db_url + '.sweeper.lock', 'w')
+        is_leader = False
+        while True:
+            if not is_leader:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    is_leader = True
+                except BlockingIOError:
+                    pass
+
+            if is_leader:
+                try:
+                    sweep_expired_payment_requests(grace_minutes, batch_size, vacuum_pages)
+                except Exception as e:
+                    logger.error("Error sweeping expired payment requests: %s", e)
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="payment-request-sweeper", daemon=True).start()